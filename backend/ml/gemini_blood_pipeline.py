@@ -3,10 +3,21 @@ import os
 import re
 import json
 import argparse
+import asyncio
+import functools
+import mimetypes
+import mmap
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
+
+from json_io import loads
+from keyword_matcher import KeywordMatcher
+from rate_limiter import TokenBucket, estimate_tokens
+from response_cache import cached_call, make_key
+
 MIN_TESTED = (3, 10)
 MAX_TESTED = (3, 12) 
 
@@ -25,13 +36,6 @@ if PY > MAX_TESTED:
         "(grpcio / pydantic-core / google-generativeai)."
     )
 
-try:
-    import google.generativeai as genai
-except Exception as e:
-    genai = None
-    _genai_import_error = e
-
-
 try:
     from dotenv import load_dotenv
 
@@ -40,7 +44,7 @@ except Exception:
     pass 
 
 
-def _raise_genai_import_error():
+def _raise_genai_import_error(error: Exception):
     """
     Raise a helpful error describing steps to fix import problems
     (missing grpcio/pydantic-core wheels on Python 3.12).
@@ -57,14 +61,27 @@ def _raise_genai_import_error():
         "       python -m pip install --upgrade pip setuptools wheel\n"
         "       python -m pip install --upgrade grpcio pydantic-core pydantic google-generativeai\n"
         "\n"
-        f"Original import error: {repr(_genai_import_error)}\n"
+        f"Original import error: {repr(error)}\n"
         "See https://pyreadiness.org/3.12/ for 3.12 readiness.\n"
     )
-    raise RuntimeError(msg)
+    raise RuntimeError(msg) from error
+
+
+def _import_genai():
+    """
+    Import google.generativeai on first use rather than at module load, so
+    commands that never reach Gemini don't pay for grpcio / pydantic-core.
+    """
+    try:
+        import google.generativeai as genai
+    except Exception as e:
+        _raise_genai_import_error(e)
+    return genai
 
+@functools.lru_cache(maxsize=None)
 def configure_api():
-    if genai is None:
-        _raise_genai_import_error()
+    """Idempotent: later calls are no-ops (failures are not cached)."""
+    genai = _import_genai()
 
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
@@ -79,12 +96,32 @@ def configure_api():
 
 
 MODEL_NAME = "gemini-2.5-flash"
+BATCH_CONCURRENCY = 8
+IMAGE_TOKENS = 258  # Gemini's flat input-token cost for a small image
 
 # ===================== LOAD REFERENCE RANGES =====================
 
+# also matches the bracketed "(lo - hi)" form
+RANGE_RE = re.compile(r"([0-9.]+)\s*[-–—]\s*([0-9.]+)")
+
 def load_reference_ranges(csv_path: str) -> pd.DataFrame:
-    df = pd.read_csv(csv_path, dtype=str).fillna("")
-    col_map = {c.lower().strip(): c for c in df.columns}
+    """
+    Parsed reference table, cached per (path, mtime) so repeated calls skip the
+    parse until the file changes. The returned DataFrame is shared; don't mutate it.
+    """
+    path = os.path.abspath(csv_path)
+    return _load_reference_ranges(path, os.path.getmtime(path))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_reference_ranges(csv_path: str, _mtime: float) -> pd.DataFrame:
+    is_parquet = str(csv_path).lower().endswith(".parquet")
+    if is_parquet:
+        import pyarrow.parquet as pq
+        columns = pq.read_schema(csv_path).names
+    else:
+        columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    col_map = {c.lower().strip(): c for c in columns}
 
     def find_col(*names):
         for n in names:
@@ -102,9 +139,18 @@ def load_reference_ranges(csv_path: str) -> pd.DataFrame:
     if test_col is None:
         raise RuntimeError(
             "CSV must contain a test name column (test_name / test / name). "
-            f"Found: {', '.join(df.columns.tolist())}"
+            f"Found: {', '.join(columns)}"
         )
 
+    # only parse the columns used below
+    if lower_col and upper_col:
+        range_col = None
+    usecols = list(dict.fromkeys(c for c in (test_col, lower_col, upper_col, range_col, unit_col, sex_col) if c))
+    if is_parquet:
+        df = pd.read_parquet(csv_path, columns=usecols).astype("string").fillna("")
+    else:
+        df = pd.read_csv(csv_path, usecols=usecols, dtype=str).fillna("")
+
     out = pd.DataFrame()
     out["test_name"] = df[test_col].astype(str).str.strip()
     out["test_name_norm"] = out["test_name"].str.lower().str.strip()
@@ -121,29 +167,13 @@ def load_reference_ranges(csv_path: str) -> pd.DataFrame:
     else:
         out["unit"] = None
 
-    def to_num(x):
-        try:
-            return float(str(x).strip())
-        except Exception:
-            return pd.NA
-
     if lower_col and upper_col:
-        out["lower"] = df[lower_col].apply(to_num)
-        out["upper"] = df[upper_col].apply(to_num)
+        out["lower"] = pd.to_numeric(df[lower_col].str.strip(), errors="coerce")
+        out["upper"] = pd.to_numeric(df[upper_col].str.strip(), errors="coerce")
     elif range_col:
-        lowers, uppers = [], []
-        for v in df[range_col].astype(str):
-            s = v.strip()
-            m = re.search(r"([0-9.]+)\s*[-–—]\s*([0-9.]+)", s)
-            if not m:
-                m = re.search(r"\(([0-9.]+)\s*[-–—]\s*([0-9.]+)\)", s)
-            if m:
-                lowers.append(to_num(m.group(1)))
-                uppers.append(to_num(m.group(2)))
-            else:
-                lowers.append(pd.NA)
-                uppers.append(pd.NA)
-        out["lower"], out["upper"] = lowers, uppers
+        extracted = df[range_col].astype(str).str.extract(RANGE_RE)
+        out["lower"] = pd.to_numeric(extracted[0], errors="coerce")
+        out["upper"] = pd.to_numeric(extracted[1], errors="coerce")
     else:
         out["lower"] = pd.NA
         out["upper"] = pd.NA
@@ -153,20 +183,27 @@ def load_reference_ranges(csv_path: str) -> pd.DataFrame:
 
     return out
 
-def find_reference_row(name: str, ref_df: pd.DataFrame) -> Optional[pd.Series]:
+def build_reference_index(ref_df: pd.DataFrame) -> Tuple[Dict[str, pd.Series], List[str]]:
+    """
+    Index reference rows by normalized test name (first row wins, as before)
+    and list the names in file order, so a partial match still picks the
+    first matching row of the CSV.
+    """
+    first = ref_df.drop_duplicates(subset=["test_name_norm"])
+    ref_index = {row.test_name_norm: row for _, row in first.iterrows()}
+    return ref_index, list(ref_index)
+
+
+def find_reference_row(name: str, ref_index: Dict[str, pd.Series], ref_norms: List[str]) -> Optional[pd.Series]:
     if not name:
         return None
 
     n = name.lower().strip()
-    exact = ref_df[ref_df["test_name_norm"] == n]
-    if not exact.empty:
-        return exact.iloc[0]
-
-    contains = ref_df[ref_df["test_name_norm"].str.contains(n, na=False)]
-    if not contains.empty:
-        return contains.iloc[0]
+    exact = ref_index.get(n)
+    if exact is not None:
+        return exact
 
-    return None
+    return next((ref_index[k] for k in ref_norms if n in k), None)
 
 def classify_value(val, lower, upper):
     try:
@@ -189,6 +226,42 @@ def classify_value(val, lower, upper):
     return "unknown"
 
 
+def _to_float(x) -> Tuple[float, bool]:
+    """float(x) and whether it parsed; an unparseable value is (nan, False)."""
+    try:
+        return float(x), True
+    except Exception:
+        return np.nan, False
+
+
+def classify_values(values, lowers, uppers, has_ref) -> np.ndarray:
+    """
+    Vectorized classify_value over aligned arrays, following the same rules in
+    the same order. Values are raw (parsed here so that an unparseable value is
+    told apart from a NaN one); missing bounds are NaN; rows with has_ref=False
+    are reported as "no_reference".
+    """
+    parsed = [_to_float(x) for x in values]
+    v = np.array([f for f, _ in parsed], dtype=float)
+    ok = np.array([good for _, good in parsed], dtype=bool)
+    lo = np.asarray(lowers, dtype=float)
+    hi = np.asarray(uppers, dtype=float)
+    has_ref = np.asarray(has_ref, dtype=bool)
+
+    conditions = [
+        ~has_ref,
+        ~ok,
+        np.isnan(lo) | np.isnan(hi),
+        v >= 2 * hi,
+        v <= 0.5 * lo,
+        (v >= lo) & (v <= hi),
+        v < lo,
+        v > hi,
+    ]
+    choices = ["no_reference", "unknown", "no_reference", "critical_high", "critical_low", "normal", "low", "high"]
+    return np.select(conditions, choices, default="unknown")
+
+
 SPECIALIST_MAP = {
     "lipid": ("Cardiologist / Dietitian", ["Reduce fats, exercise daily."]),
     "glucose": ("Endocrinologist", ["Reduce sugar intake, check HbA1c."]),
@@ -198,12 +271,12 @@ SPECIALIST_MAP = {
 }
 
 
+SPECIALIST_MATCHER = KeywordMatcher(SPECIALIST_MAP)
+
+
 def suggest_specialist(test_name):
-    n = (test_name or "").lower()
-    for key, val in SPECIALIST_MAP.items():
-        if key in n:
-            return val
-    return SPECIALIST_MAP["default"]
+    key = SPECIALIST_MATCHER.first((test_name or "").lower())
+    return SPECIALIST_MAP[key] if key is not None else SPECIALIST_MAP["default"]
 
 
 # ===================== GEMINI PROMPT =====================
@@ -224,39 +297,56 @@ def build_prompt() -> str:
 # ===================== GEMINI CALL =====================
 
 def call_gemini_with_image(image_path: str, prompt: str, model_name: str = MODEL_NAME) -> str:
-    if genai is None:
-        _raise_genai_import_error()
-
-    try:
-        model = genai.GenerativeModel(model_name)
-    except AttributeError:
-        try:
-            response = genai.generate_text(
-                model=model_name, prompt=prompt, images=[image_path]
-            )
+    genai = _import_genai()
+
+    mime = mimetypes.guess_type(image_path)[0] or "application/octet-stream"
+    if os.path.getsize(image_path) == 0:
+        raise RuntimeError(f"Report file is empty: {image_path}")
+
+    # mmap the file: hashing reads it in place and the SDK gets a single bytes copy
+    with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+        def _report_part():
+            if mime == "application/pdf":
+                # resumable upload streams the PDF instead of inlining it in the request
+                return genai.upload_file(image_path, mime_type=mime)
+            return {"mime_type": mime, "data": bytes(mm)}
+
+        def _generate() -> str:
+            try:
+                model = genai.GenerativeModel(model_name)
+            except AttributeError:
+                try:
+                    response = genai.generate_text(
+                        model=model_name, prompt=prompt, images=[image_path]
+                    )
+                    return getattr(response, "text", str(response))
+                except Exception as e:
+                    raise RuntimeError("Failed to call Google GenAI SDK: " + str(e))
+
+            response = model.generate_content([prompt, _report_part()])
             return getattr(response, "text", str(response))
-        except Exception as e:
-            raise RuntimeError("Failed to call Google GenAI SDK: " + str(e))
 
-    with open(image_path, "rb") as f:
-        image_bytes = f.read()
-
-    response = model.generate_content(
-        [prompt, {"mime_type": "image/png", "data": image_bytes}]
-    )
-    return getattr(response, "text", str(response))
+        # a reply build_report can't parse (e.g. a refusal) is not cached, so a retry asks again
+        return cached_call(
+            make_key(prompt, model_name, mm), _generate,
+            validate=lambda text: extract_json_from_text(text) is not None,
+        )
 
 
 # ===================== PARSE GEMINI OUTPUT =====================
 
+JSON_RE = re.compile(r"(\{.*\})", re.S)
+
+
 def extract_json_from_text(text: str) -> Optional[Dict[str, Any]]:
     if not text:
         return None
     try:
-        match = re.search(r"(\{.*\})", text, re.S)
+        match = JSON_RE.search(text)
         if match:
-            return json.loads(match.group(1))
-        return json.loads(text)
+            return loads(match.group(1))
+        return loads(text)
     except Exception:
         return None
 
@@ -267,6 +357,37 @@ def analyze_report(image_path, csv_path, model_name=MODEL_NAME):
     configure_api()
     prompt = build_prompt()
     model_output = call_gemini_with_image(image_path, prompt, model_name)
+    ref_index, ref_norms = build_reference_index(load_reference_ranges(csv_path))
+    return build_report(model_output, ref_index, ref_norms)
+
+
+async def analyze_reports(paths: List[str], csv_path, model_name=MODEL_NAME, concurrency: int = BATCH_CONCURRENCY):
+    """
+    Analyze many report images concurrently. Gemini calls run in worker threads,
+    at most `concurrency` at a time, and are paced by a token bucket. The
+    reference CSV is loaded once for the whole batch. Returns one report per
+    path, in order; a failed image yields {"image": path, "error": ...}.
+    """
+    configure_api()
+    prompt = build_prompt()
+    ref_index, ref_norms = build_reference_index(load_reference_ranges(csv_path))
+    sem = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket()
+    est_tokens = estimate_tokens(prompt) + IMAGE_TOKENS
+
+    async def _one(path):
+        async with sem:
+            await bucket.acquire(est_tokens)
+            try:
+                model_output = await asyncio.to_thread(call_gemini_with_image, path, prompt, model_name)
+                return build_report(model_output, ref_index, ref_norms)
+            except Exception as e:
+                return {"image": path, "error": str(e)}
+
+    return await asyncio.gather(*(_one(p) for p in paths))
+
+
+def build_report(model_output: str, ref_index: Dict[str, pd.Series], ref_norms: List[str]) -> Dict[str, Any]:
     parsed = extract_json_from_text(model_output)
 
     if parsed is None:
@@ -274,27 +395,26 @@ def analyze_report(image_path, csv_path, model_name=MODEL_NAME):
             f"ERROR: Could not parse JSON from model output:\n{model_output[:500]}"
         )
 
-    ref_df = load_reference_ranges(csv_path)
     report = {"sex": parsed.get("sex"), "tests": [], "flags": [], "raw_output": model_output}
 
-    for t in parsed.get("tests", []):
-        name = t.get("name", "")
-        val = t.get("value")
-        unit = t.get("unit")
-        ref = find_reference_row(name, ref_df)
-
-        if ref is not None:
-            lower, upper = ref["lower"], ref["upper"]
-            status = classify_value(val, lower, upper)
-        else:
-            lower = upper = None
-            status = "no_reference"
-
+    tests = parsed.get("tests", [])
+    names = [t.get("name", "") for t in tests]
+    refs = [find_reference_row(name, ref_index, ref_norms) for name in names]
+    lowers = [ref["lower"] if ref is not None else None for ref in refs]
+    uppers = [ref["upper"] if ref is not None else None for ref in refs]
+    statuses = classify_values(
+        [t.get("value") for t in tests],
+        [np.nan if lo is None else lo for lo in lowers],
+        [np.nan if up is None else up for up in uppers],
+        [ref is not None for ref in refs],
+    ).tolist()
+
+    for t, name, lower, upper, status in zip(tests, names, lowers, uppers, statuses):
         specialist, adv = suggest_specialist(name)
         entry = {
             "name": name,
-            "value": val,
-            "unit": unit,
+            "value": t.get("value"),
+            "unit": t.get("unit"),
             "status": status,
             "reference_lower": lower,
             "reference_upper": upper,
@@ -15,18 +15,20 @@ Output:
 """
 import os
 import sys
+import asyncio
 import json
 import re
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
 
+from json_io import loads, dumps
+from keyword_matcher import KeywordMatcher
+from rate_limiter import TokenBucket, estimate_tokens
+from response_cache import cached_call, make_key
+
 load_dotenv()
 
-# try import genai (optional)
-try:
-    import google.generativeai as genai
-except Exception:
-    genai = None
+JSON_BLOB_RE = re.compile(r"(\{[\s\S]*\})")
 
 # minimal specialist mapping for fallback suggestions
 FALLBACK_SPECIALIST_MAP = {
@@ -36,6 +38,7 @@ FALLBACK_SPECIALIST_MAP = {
     "triglyceride": ("Cardiologist / Dietitian", ["Reduce simple carbs/saturated fats; increase activity."]),
     "default": ("General Physician", ["Review results with your physician."])
 }
+FALLBACK_SPECIALIST_MATCHER = KeywordMatcher(FALLBACK_SPECIALIST_MAP)
 
 
 def normalize_tests(input_obj: Any) -> List[Dict[str, Any]]:
@@ -162,13 +165,13 @@ def fallback_recommendations(tests: List[Dict[str, Any]]) -> Dict[str, Any]:
             severity = max(severity, 1)
 
         # choose matching fallback mapping
-        for key, (spec, tips) in FALLBACK_SPECIALIST_MAP.items():
-            if key in name:
-                if cls != "normal":
-                    for tip in tips:
-                        suggestions.append(f"{t.get('name')}: {tip}")
-                    referrals.append({"test": t.get("name"), "specialist": spec, "urgency": "routine" if cls == "abnormal" else "urgent"})
-                break
+        key = FALLBACK_SPECIALIST_MATCHER.first(name)
+        if key is not None:
+            spec, tips = FALLBACK_SPECIALIST_MAP[key]
+            if cls != "normal":
+                for tip in tips:
+                    suggestions.append(f"{t.get('name')}: {tip}")
+                referrals.append({"test": t.get("name"), "specialist": spec, "urgency": "routine" if cls == "abnormal" else "urgent"})
         else:
             if cls != "normal":
                 suggestions.append(f"{t.get('name')}: Please review this result with your doctor.")
@@ -208,7 +211,13 @@ def call_gemini(tests: List[Dict[str, Any]], model_name: str = "gemini-2.5-flash
     Call Gemini (google.generativeai). Returns parsed JSON on success, None on failure.
     """
     api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key or genai is None:
+    if not api_key:
+        return None
+
+    # imported lazily: the SDK is optional and slow to load
+    try:
+        import google.generativeai as genai
+    except Exception:
         return None
 
     # configure
@@ -220,36 +229,65 @@ def call_gemini(tests: List[Dict[str, Any]], model_name: str = "gemini-2.5-flash
 
     prompt = build_gemini_prompt(tests)
 
-    try:
+    def _generate() -> str:
         # prefer GenerativeModel if available
         model = getattr(genai, "GenerativeModel", None)
         if model:
             model_obj = genai.GenerativeModel(model_name)
             resp = model_obj.generate_content([prompt])
-            text = getattr(resp, "text", str(resp))
         else:
             # fallback to generic generate_text (sdk differences)
             resp = genai.generate_text(model=model_name, prompt=prompt)
-            text = getattr(resp, "text", str(resp))
+        return getattr(resp, "text", str(resp))
+
+    payload = json.dumps(tests, sort_keys=True).encode()
+    try:
+        # unparseable replies are not cached, so a retry asks again
+        text = cached_call(
+            make_key(prompt, model_name, payload), _generate,
+            validate=lambda t: parse_gemini_text(t) is not None,
+        )
     except Exception as e:
         # SDK failed
         print(f"[WARN] Gemini call failed: {e}", file=sys.stderr)
         return None
 
+    return parse_gemini_text(text)
+
+
+def parse_gemini_text(text: str) -> Optional[Dict[str, Any]]:
     # extract JSON blob
-    m = re.search(r"(\{[\s\S]*\})", text)
+    m = JSON_BLOB_RE.search(text)
     if not m:
         # try if output is already pure JSON
         try:
-            return json.loads(text)
+            return loads(text)
         except Exception:
             return None
     try:
-        return json.loads(m.group(1))
+        return loads(m.group(1))
     except Exception:
         return None
 
 
+async def call_gemini_batch(tests_list: List[List[Dict[str, Any]]], model_name: str = "gemini-2.5-flash",
+                            concurrency: int = 8) -> List[Optional[Dict[str, Any]]]:
+    """
+    Run call_gemini for many test lists concurrently in worker threads, at most
+    `concurrency` at a time and paced by a token bucket. Results keep input order;
+    entries are None where call_gemini would return None.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    bucket = TokenBucket()
+
+    async def _one(tests):
+        async with sem:
+            await bucket.acquire(estimate_tokens(build_gemini_prompt(tests)))
+            return await asyncio.to_thread(call_gemini, tests, model_name)
+
+    return await asyncio.gather(*(_one(t) for t in tests_list))
+
+
 def main():
     if len(sys.argv) < 2:
         print("Usage: gemini_recommendations.py <report_or_items_json_path>", file=sys.stderr)
@@ -258,25 +296,25 @@ def main():
     fp = sys.argv[1]
     try:
         with open(fp, "r", encoding="utf-8-sig") as f:
-            data = json.load(f)
+            data = loads(f.read())
     except Exception as e:
         print(f"Error reading {fp}: {e}", file=sys.stderr)
         sys.exit(3)
 
     tests = normalize_tests(data)
     if not tests:
-        print(json.dumps({"overall_risk": "unknown", "suggestions": [], "specialist_referrals": []}, indent=2, ensure_ascii=False))
+        print(dumps({"overall_risk": "unknown", "suggestions": [], "specialist_referrals": []}, indent=True))
         return
 
     # Attempt to call Gemini
     gemini_result = call_gemini(tests)
     if gemini_result and isinstance(gemini_result, dict):
-        print(json.dumps(gemini_result, indent=2, ensure_ascii=False))
+        print(dumps(gemini_result, indent=True))
         return
 
     # fallback
     fallback = fallback_recommendations(tests)
-    print(json.dumps(fallback, indent=2, ensure_ascii=False))
+    print(dumps(fallback, indent=True))
 
 
 if __name__ == "__main__":
@@ -3,6 +3,9 @@ import pandas as pd
 import numpy as np
 import os
 import sys
+import argparse
+import hashlib
+from pathlib import Path
 
 # support both file locations
 CANDIDATES = [
@@ -23,76 +26,116 @@ if DATA_PATH is None:
         print("  -", os.path.abspath(p))
     sys.exit(1)
 
-OUT_PATH = os.path.join(os.path.dirname(__file__), "synthetic_training.csv")
+# Parquet keeps float dtypes and is much faster to write/read; CSV only if pyarrow is missing
+try:
+    import pyarrow  # noqa: F401
+    OUT_PATH = os.path.join(os.path.dirname(__file__), "synthetic_training.parquet")
+except ImportError:
+    OUT_PATH = os.path.join(os.path.dirname(__file__), "synthetic_training.csv")
+HASH_PATH = OUT_PATH + ".sha256"
 RANDOM_SEED = 42
-np.random.seed(RANDOM_SEED)
+N_PER_CLASS = 300
+CLASSES = ["low", "normal", "high"]
+FLOAT_COLUMNS = ["value", "ref_lower", "ref_upper", "pct_of_range", "distance_lower", "distance_upper"]
 
-def sample_for_row(row, n_per_class=300):
-    lower = float(row["lower_ref"])
-    upper = float(row["upper_ref"])
-    if upper <= lower:
-        upper = lower * 1.05 if lower > 0 else lower + 1.0
+def class_bounds(lower, upper):
+    """Per-row (min, max) sampling bounds for the low / normal / high classes."""
+    upper = np.where(upper <= lower, np.where(lower > 0, lower * 1.05, lower + 1.0), upper)
+    width = upper - lower
 
-    samples = []
-    low_min = max(lower - (upper - lower), 0, lower * 0.5)
+    low_min = np.maximum(np.maximum(lower - width, 0), lower * 0.5)
     low_max = lower * 0.99
     normal_min = lower
     normal_max = upper
     high_min = upper * 1.01
-    high_max = upper + (upper - lower) if (upper - lower) > 0 else upper * 1.3
-
-    if normal_max <= normal_min:
-        normal_min = lower * 0.95
-        normal_max = upper * 1.05
+    high_max = np.where(width > 0, upper + width, upper * 1.3)
+
+    bad_normal = normal_max <= normal_min
+    normal_min = np.where(bad_normal, lower * 0.95, normal_min)
+    normal_max = np.where(bad_normal, upper * 1.05, normal_max)
+
+    return [(low_min, low_max), (normal_min, normal_max), (high_min, high_max)]
+
+def sample_rows(df, rng, n_per_class=N_PER_CLASS):
+    """
+    Sample n_per_class values per class for every row of df in one RNG call
+    per class. Output keeps the row-major order: for each row, its low,
+    normal and high blocks.
+    """
+    lower = df["lower_ref"].to_numpy(dtype=float)
+    upper = df["upper_ref"].to_numpy(dtype=float)
+    n_rows = len(df)
+
+    # fill one preallocated (rows, class, sample) buffer so the flattened order is row-major
+    values = np.empty((n_rows, len(CLASSES), n_per_class), dtype=np.float32)
+    for i, (lo, hi) in enumerate(class_bounds(lower, upper)):
+        values[:, i, :] = rng.uniform(lo[:, None], hi[:, None], size=(n_rows, n_per_class))
+
+    per_row = len(CLASSES) * n_per_class
+
+    def meta(col):
+        return np.repeat(df[col].to_numpy(), per_row) if col in df.columns else ""
+
+    return pd.DataFrame({
+        "test_name": meta("test_name"),
+        "unit": meta("unit"),
+        "sex": meta("sex"),
+        "category": meta("category"),
+        "value": values.ravel(),
+        "label": np.tile(np.repeat(CLASSES, n_per_class), n_rows),
+    })
+
+def inputs_key(n_per_class=N_PER_CLASS):
+    """Hash of everything the output depends on: reference CSV, seed, sample count and this script."""
+    return hashlib.sha256(
+        Path(DATA_PATH).read_bytes()
+        + str(RANDOM_SEED).encode()
+        + str(n_per_class).encode()
+        + Path(__file__).read_bytes()
+    ).hexdigest()
+
+def is_up_to_date(key):
+    return (
+        os.path.exists(OUT_PATH)
+        and os.path.exists(HASH_PATH)
+        and Path(HASH_PATH).read_text().strip() == key
+    )
 
-    for _ in range(n_per_class):
-        lv = float(np.random.uniform(low_min, low_max))
-        samples.append((row["test_name"], row.get("unit", ""), row.get("sex", ""), row.get("category", ""), lv, "low"))
-    for _ in range(n_per_class):
-        nv = float(np.random.uniform(normal_min, normal_max))
-        samples.append((row["test_name"], row.get("unit", ""), row.get("sex", ""), row.get("category", ""), nv, "normal"))
-    for _ in range(n_per_class):
-        hv = float(np.random.uniform(high_min, high_max))
-        samples.append((row["test_name"], row.get("unit", ""), row.get("sex", ""), row.get("category", ""), hv, "high"))
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic training data from WHO reference ranges.")
+    parser.add_argument("--force", action="store_true", help="Regenerate even if the inputs are unchanged")
+    args = parser.parse_args()
 
-    return samples
+    key = inputs_key()
+    if not args.force and is_up_to_date(key):
+        print(f"✅ {OUT_PATH} is up to date (inputs unchanged); skipping generation.")
+        return
 
-def main():
     df = pd.read_csv(DATA_PATH)
-    all_samples = []
-    for _, row in df.iterrows():
-        try:
-            _ = float(row["lower_ref"])
-            _ = float(row["upper_ref"])
-        except Exception:
-            continue
-        samples = sample_for_row(row, n_per_class=300)
-        all_samples.extend(samples)
-
-    df_out = pd.DataFrame(all_samples, columns=["test_name", "unit", "sex", "category", "value", "label"])
-
-    # --- handle duplicates in who_ranges.csv: drop duplicates by test_name when building ref_map
-    ref_map = (
-        df.drop_duplicates(subset=["test_name"])
-          .set_index("test_name")[["lower_ref", "upper_ref"]]
-          .to_dict(orient="index")
-    )
+    for col in ("lower_ref", "upper_ref"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    valid = df.dropna(subset=["lower_ref", "upper_ref"])
+
+    rng = np.random.default_rng(RANDOM_SEED)
+    df_out = sample_rows(valid, rng, n_per_class=N_PER_CLASS)
 
-    lower_list, upper_list = [], []
-    for t in df_out["test_name"]:
-        info = ref_map.get(t, {"lower_ref": None, "upper_ref": None})
-        lower = float(info["lower_ref"]) if info["lower_ref"] not in (None, "") else float("nan")
-        upper = float(info["upper_ref"]) if info["upper_ref"] not in (None, "") else float("nan")
-        lower_list.append(lower)
-        upper_list.append(upper)
-    df_out["ref_lower"] = lower_list
-    df_out["ref_upper"] = upper_list
+    # --- handle duplicates in who_ranges.csv: first row per test_name supplies the reference range
+    ref_map = df.drop_duplicates(subset=["test_name"]).set_index("test_name")
+    df_out["ref_lower"] = df_out["test_name"].map(ref_map["lower_ref"].astype(float))
+    df_out["ref_upper"] = df_out["test_name"].map(ref_map["upper_ref"].astype(float))
 
     df_out["pct_of_range"] = (df_out["value"] - df_out["ref_lower"]) / (df_out["ref_upper"] - df_out["ref_lower"] + 1e-8)
     df_out["distance_lower"] = df_out["value"] - df_out["ref_lower"]
     df_out["distance_upper"] = df_out["ref_upper"] - df_out["value"]
 
-    df_out.to_csv(OUT_PATH, index=False)
+    # lab values don't need double precision; float32 halves the dataset and training bandwidth
+    df_out = df_out.astype({col: "float32" for col in FLOAT_COLUMNS})
+
+    if OUT_PATH.endswith(".parquet"):
+        df_out.to_parquet(OUT_PATH, index=False)
+    else:
+        df_out.to_csv(OUT_PATH, index=False)
+    Path(HASH_PATH).write_text(key + "\n")
     print(f"✅ Saved synthetic dataset to {OUT_PATH}. Rows: {len(df_out)}")
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+# backend/ml/json_io.py
+"""
+JSON helpers shared by the ml scripts.
+
+orjson parses/serializes several times faster; the stdlib json module is used
+when it isn't installed. Output is UTF-8 (non-ASCII characters are not
+escaped) either way.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj, indent: bool = False) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+
+    def dumps_bytes(obj) -> bytes:
+        return orjson.dumps(obj)
+else:
+    loads = json.loads
+
+    def dumps(obj, indent: bool = False) -> str:
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None)
+
+    def dumps_bytes(obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode()
@@ -0,0 +1,35 @@
+# backend/ml/keyword_matcher.py
+"""
+Substring keyword lookup for the specialist maps.
+
+Builds an Aho-Corasick automaton once (pyahocorasick), so each test name is
+scanned in a single linear pass instead of one `key in name` check per key.
+Falls back to the plain loop when pyahocorasick is not installed.
+"""
+from typing import Iterable, Optional
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = list(keywords)
+        self._automaton = None
+        if ahocorasick is not None and self.keywords:
+            self._automaton = ahocorasick.Automaton()
+            for priority, key in enumerate(self.keywords):
+                self._automaton.add_word(key, priority)
+            self._automaton.make_automaton()
+
+    def first(self, text: str) -> Optional[str]:
+        """
+        Return the earliest keyword (in the order given) that occurs in `text`,
+        i.e. what `next(k for k in keywords if k in text)` would return, or None.
+        """
+        if self._automaton is None:
+            return next((k for k in self.keywords if k in text), None)
+        best = min((priority for _, priority in self._automaton.iter(text)), default=None)
+        return None if best is None else self.keywords[best]
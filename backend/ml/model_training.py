@@ -1,51 +1,73 @@
 import pandas as pd
-from sklearn.ensemble import RandomForestClassifier
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 import joblib
 import os
+import sys
+import hashlib
+from pathlib import Path
 
-# Step 1: Load dataset
 data_path = os.path.join(os.path.dirname(__file__), "who_ranges.csv")
-df = pd.read_csv(data_path)
+model_path = os.path.join(os.path.dirname(__file__), "model.pkl")
+encoder_path = os.path.join(os.path.dirname(__file__), "label_encoder.pkl")
+hash_path = model_path + ".sha256"
+FEATURES = ["lower_ref", "upper_ref", "avg_ref"]
+
+# Step 0: Skip retraining if the data, feature set and this script are unchanged
+# (and nothing else has rewritten model.pkl since)
+key = hashlib.sha256(
+    Path(data_path).read_bytes() + ",".join(FEATURES).encode() + Path(__file__).read_bytes()
+).hexdigest()
+if (
+    "--force" not in sys.argv
+    and os.path.exists(model_path)
+    and os.path.exists(encoder_path)
+    and os.path.exists(hash_path)
+    and Path(hash_path).read_text().strip() == key
+    and os.path.getmtime(model_path) <= os.path.getmtime(hash_path)
+):
+    print(f"✅ Model is up to date with {data_path}; skipping training.")
+    sys.exit(0)
+
+# Step 1: Load dataset (only the columns used below, with explicit dtypes)
+df = pd.read_csv(
+    data_path,
+    usecols=["lower_ref", "upper_ref", "flag_low", "flag_high"],
+    dtype={"lower_ref": "float32", "upper_ref": "float32", "flag_low": "int8", "flag_high": "int8"},
+)
 
 # Step 2: Prepare data
 # We'll predict if a test is more likely to indicate "low", "normal", or "high" based on ref ranges
 # Add synthetic mid-value (average of lower and upper)
-df["avg_ref"] = (df["lower_ref"] + df["upper_ref"]) / 2
+df["avg_ref"] = (df["lower_ref"].to_numpy() + df["upper_ref"].to_numpy()) * 0.5
 
 # Create simple label for target
-conditions = []
-for i, row in df.iterrows():
-    if row["flag_low"] == 1 and row["flag_high"] == 0:
-        label = "low"
-    elif row["flag_high"] == 1 and row["flag_low"] == 0:
-        label = "high"
-    else:
-        label = "normal"
-    conditions.append(label)
-
-df["label"] = conditions
+flag_low = df["flag_low"].to_numpy()
+flag_high = df["flag_high"].to_numpy()
+low_mask = (flag_low == 1) & (flag_high == 0)
+high_mask = (flag_high == 1) & (flag_low == 0)
+df["label"] = np.select([low_mask, high_mask], ["low", "high"], default="normal")
 
 # Step 3: Select features
-X = df[["lower_ref", "upper_ref", "avg_ref"]]
+X = df[FEATURES].astype("float32")
 le = LabelEncoder()
 y = le.fit_transform(df["label"])
 
 # Step 4: Train model
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-model = RandomForestClassifier(n_estimators=100, random_state=42)
+# Histogram-based boosting: bins features once, trains faster and pickles smaller than a 100-tree forest
+model = HistGradientBoostingClassifier(max_iter=100, learning_rate=0.1, max_leaf_nodes=15, random_state=42)
 model.fit(X_train, y_train)
 
 accuracy = model.score(X_test, y_test)
 print(f"✅ Model trained successfully! Accuracy: {accuracy:.2f}")
 
 # Step 5: Save model & label encoder
-model_path = os.path.join(os.path.dirname(__file__), "model.pkl")
-encoder_path = os.path.join(os.path.dirname(__file__), "label_encoder.pkl")
-
-joblib.dump(model, model_path)
+joblib.dump(model, model_path, compress=3)
 joblib.dump(le, encoder_path)
+Path(hash_path).write_text(key + "\n")
 
 print(f"💾 Saved model to: {model_path}")
 print(f"💾 Saved label encoder to: {encoder_path}")
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 # backend/ml/parse_extracted.py
-import re, json, sys, os
+import re, sys, os
 from typing import List, Dict
 
+from json_io import loads, dumps
+
 # Remove known header pieces that sometimes get concatenated
 HEADER_PHRASES = [
     r"Report\s+ID[:\s]*\S+",
@@ -15,6 +17,59 @@ HEADER_PHRASES = [
 ]
 
 HEADER_RE = re.compile("|".join(HEADER_PHRASES), flags=re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'\s+')
+# stray column-header words that get glued onto test names
+STRAY_WORDS_RE = re.compile(r'\b(Result|Reference|Range|Test)\b', flags=re.IGNORECASE)
+
+# Every header phrase starts with a literal keyword, so matches can only begin where one
+# occurs. Hyperscan finds those anchors in a single DFA pass and HEADER_RE is only tried
+# there; without hyperscan (no Windows wheels), or for non-ASCII text, HEADER_RE scans
+# the whole text.
+HEADER_KEYWORDS = list(dict.fromkeys(re.match(r"[A-Za-z]+", p).group() for p in HEADER_PHRASES))
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+def _compile_header_db():
+    if hyperscan is None:
+        return None
+    try:
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[k.encode() for k in HEADER_KEYWORDS],
+            ids=list(range(len(HEADER_KEYWORDS))),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SOM_LEFTMOST] * len(HEADER_KEYWORDS),
+        )
+        return db
+    except Exception:
+        return None
+
+HEADER_DB = _compile_header_db()
+
+def strip_headers(text: str) -> str:
+    """Replace every header phrase match with a single space (same result as HEADER_RE.sub)."""
+    # HS_FLAG_CASELESS folds ASCII only, while re.IGNORECASE also matches e.g. "ſ" for "s"
+    if HEADER_DB is None or not text.isascii():
+        return HEADER_RE.sub(' ', text)
+
+    anchors = set()
+    HEADER_DB.scan(text.encode('ascii'), match_event_handler=lambda _id, start, _end, _flags, _ctx: anchors.add(start))
+    if not anchors:
+        return text
+
+    # leftmost non-overlapping matches, spliced out in one pass
+    pieces, pos = [], 0
+    for start in sorted(anchors):
+        if start < pos:
+            continue
+        m = HEADER_RE.match(text, start)
+        if m:
+            pieces += [text[pos:start], ' ']
+            pos = m.end()
+    pieces.append(text[pos:])
+    return ''.join(pieces)
 
 # Pattern: test name (words/spaces + optional paren units) value lower - upper
 PATTERN = re.compile(
@@ -29,9 +84,9 @@ PATTERN = re.compile(
 def clean_text(text: str) -> str:
     t = text.replace('\r', ' ').replace('\n', ' ')
     # remove header phrases
-    t = HEADER_RE.sub(' ', t)
+    t = strip_headers(t)
     # collapse long whitespace
-    t = re.sub(r'\s+', ' ', t).strip()
+    t = WHITESPACE_RE.sub(' ', t).strip()
     return t
 
 def parse_text_to_items(text: str) -> List[Dict]:
@@ -44,7 +99,7 @@ def parse_text_to_items(text: str) -> List[Dict]:
         test_raw, value_s, lower_s, upper_s = m
         test = test_raw.strip()
         # remove trailing words that are obviously not tests (like stray "Result" or "Reference")
-        test = re.sub(r'\b(Result|Reference|Range|Test)\b', '', test, flags=re.IGNORECASE).strip()
+        test = STRAY_WORDS_RE.sub('', test).strip()
         # drop any leading single-letter tokens (like "M" from Sex)
         if len(test) <= 2 and test.isalpha():
             continue
@@ -61,24 +116,20 @@ def parse_text_to_items(text: str) -> List[Dict]:
         except Exception:
             continue
 
-    # dedupe
-    seen = set()
-    dedup = []
+    # dedupe (case-insensitive on the name), keeping the first occurrence; dicts keep insertion order
+    dedup = {}
     for it in items:
-        key = (it["test"].lower(), it["value"], it["ref_lower"], it["ref_upper"])
-        if key not in seen:
-            seen.add(key)
-            dedup.append(it)
-    return dedup
+        dedup.setdefault((it["test"].casefold(), it["value"], it["ref_lower"], it["ref_upper"]), it)
+    return list(dedup.values())
 
 def load_input(fp: str):
     if fp == '-' or not fp:
         raw = sys.stdin.read()
         if not raw.strip():
             raise SystemExit("no stdin input")
-        return json.loads(raw)
+        return loads(raw)
     with open(fp, 'r', encoding='utf-8-sig') as f:
-        return json.load(f)
+        return loads(f.read())
 
 def main():
     if len(sys.argv) < 2:
@@ -99,10 +150,10 @@ def main():
     out = {"items": items}
     if outpath:
         with open(outpath, "w", encoding="utf-8") as f:
-            json.dump(out, f, ensure_ascii=False, indent=2)
+            f.write(dumps(out, indent=True))
         print(f"Saved {len(items)} items to {outpath}")
     else:
-        print(json.dumps(out, ensure_ascii=False))
+        print(dumps(out))
 
 if __name__ == "__main__":
     main()
@@ -1,67 +1,163 @@
 # backend/ml/predict_model.py
 import sys
-import json
 import os
 import joblib
 import numpy as np
 
+from json_io import loads, dumps_bytes
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
 BASE = os.path.dirname(__file__)
 MODEL_P = os.path.join(BASE, "model.pkl")
 ENC_P = os.path.join(BASE, "label_encoder.pkl")
 SCALER_P = os.path.join(BASE, "scaler.pkl")
+ONNX_P = os.path.join(BASE, "model.onnx")
+
+class OnnxModel:
+    """model.predict() backed by an onnxruntime session over model.onnx."""
+    def __init__(self, path):
+        self.sess = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        self.input_name = self.sess.get_inputs()[0].name
+        self.label_name = self.sess.get_outputs()[0].name
+
+    def predict(self, X):
+        return self.sess.run([self.label_name], {self.input_name: np.asarray(X, dtype=np.float32)})[0]
+
+def use_onnx():
+    # only when the export is at least as new as the pickle it was made from
+    return (
+        onnxruntime is not None
+        and os.path.exists(ONNX_P)
+        and os.path.getmtime(ONNX_P) >= os.path.getmtime(MODEL_P)
+    )
+
+# (model, label encoder, (mean, scale) or None), loaded once per process and
+# reloaded when train_model.py replaces the artifacts
+_ARTIFACTS = None
+_ARTIFACTS_KEY = None
+
+def _artifacts_key():
+    # mtimes of every file load_artifacts reads (None when absent)
+    return tuple(
+        os.stat(p).st_mtime_ns if os.path.exists(p) else None
+        for p in (MODEL_P, ENC_P, SCALER_P, ONNX_P)
+    )
 
 def load_artifacts():
-    if not (os.path.exists(MODEL_P) and os.path.exists(ENC_P) and os.path.exists(SCALER_P)):
+    global _ARTIFACTS, _ARTIFACTS_KEY
+    if not (os.path.exists(MODEL_P) and os.path.exists(ENC_P)):
         raise FileNotFoundError("Model artifacts missing. Run train_model.py first.")
-    model = joblib.load(MODEL_P)
-    le = joblib.load(ENC_P)
-    scaler = joblib.load(SCALER_P)
-    return model, le, scaler
+    key = _artifacts_key()
+    if _ARTIFACTS is not None and key == _ARTIFACTS_KEY:
+        return _ARTIFACTS
+    # mmap_mode: numpy arrays inside the (uncompressed) pickles, such as tree node
+    # tables and classes_, are mapped from disk instead of copied into memory
+    model = OnnxModel(ONNX_P) if use_onnx() else joblib.load(MODEL_P, mmap_mode="r")
+    le = joblib.load(ENC_P, mmap_mode="r")
+    # current models take raw features; scaler.pkl only ships with older ones
+    scaling = None
+    if os.path.exists(SCALER_P):
+        scaler = joblib.load(SCALER_P, mmap_mode="r")
+        # StandardScaler.transform as plain array math, minus sklearn's input validation
+        mean = np.asarray(scaler.mean_, dtype=np.float64) if scaler.with_mean else 0.0
+        scale = np.asarray(scaler.scale_, dtype=np.float64) if scaler.with_std else 1.0
+        scaling = (mean, scale)
+    _ARTIFACTS = (model, le, scaling)
+    _ARTIFACTS_KEY = key
+    return _ARTIFACTS
 
 def prepare_features(items):
-    rows = []
-    for it in items:
-        value = float(it.get("value", 0))
-        low = float(it.get("ref_lower") if it.get("ref_lower") is not None else float("nan"))
-        up = float(it.get("ref_upper") if it.get("ref_upper") is not None else float("nan"))
-        pct_of_range = (value - low) / (up - low + 1e-8) if not (np.isnan(low) or np.isnan(up)) else 0.0
-        dist_low = value - low
-        dist_up = up - value
-        rows.append([value, low, up, pct_of_range, dist_low, dist_up])
-    return np.array(rows, dtype=float)
+    # one float32 buffer, filled column by column; the derived columns are
+    # computed straight into it, so no per-column temporaries are stacked.
+    # float32: the tree models split on float32 internally, so float64 only doubles the bytes
+    X = np.empty((len(items), 6), dtype=np.float32)
+    value, low, up, pct_of_range, dist_low, dist_up = X.T
+    # a missing or null value counts as 0 (the model can't score a NaN reading)
+    value[:] = [0 if it.get("value") is None else it["value"] for it in items]
+    low[:] = [it.get("ref_lower") for it in items]  # None -> NaN
+    up[:] = [it.get("ref_upper") for it in items]
+    np.subtract(value, low, out=dist_low)
+    np.subtract(up, value, out=dist_up)
+    np.subtract(up, low, out=pct_of_range)
+    pct_of_range += 1e-8
+    np.divide(dist_low, pct_of_range, out=pct_of_range)
+    pct_of_range[np.isnan(low) | np.isnan(up)] = 0.0
+    return X
+
+def emit(obj, out=None):
+    # one JSON document per line, written as bytes straight to stdout
+    out = out or sys.stdout.buffer
+    out.write(dumps_bytes(obj) + b"\n")
+    out.flush()
 
 def read_input():
     if len(sys.argv) > 1:
         fp = sys.argv[1]
-        with open(fp, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(fp, "rb") as f:
+            return loads(f.read())
     raw = sys.stdin.read()
     if not raw.strip():
-        print(json.dumps({"error":"no input provided"}, ensure_ascii=False))
+        emit({"error":"no input provided"})
         sys.exit(0)
-    return json.loads(raw)
+    return loads(raw)
 
-def main():
-    data = read_input()
-    items = data.get("items") if isinstance(data, dict) and data.get("items") else data
+def predict(data):
+    items = data.get("items") if isinstance(data, dict) and "items" in data else data
     if not isinstance(items, list):
-        print(json.dumps({"error":"expected a list of items or {items:[...]}"}, ensure_ascii=False))
-        return
-    model, le, scaler = load_artifacts()
+        return {"error": "expected a list of items or {items:[...]}"}
+    if not items:
+        # a report with no parsed test rows still goes on to be saved
+        return {"ok": True, "predictions": []}
+    model, le, scaling = load_artifacts()
     X = prepare_features(items)
-    X_scaled = scaler.transform(X)
-    preds = model.predict(X_scaled)
+    if scaling is not None:
+        # legacy scaled models were fit in float64; scaling in float32 shifts
+        # values across XGB split thresholds. The upcast copy is ours, so scale in place.
+        mean, scale = scaling
+        X = X.astype(np.float64)
+        X -= mean
+        X /= scale
+    preds = model.predict(X)
     labels = le.inverse_transform(preds)
-    out = []
+    # the parsed request is thrown away after the reply, so label the items in place
     for it, lab in zip(items, labels):
-        out.append({
-            "test": it.get("test"),
-            "value": it.get("value"),
-            "ref_lower": it.get("ref_lower"),
-            "ref_upper": it.get("ref_upper"),
-            "prediction": lab
-        })
-    print(json.dumps({"ok": True, "predictions": out}, ensure_ascii=False))
+        it["prediction"] = lab
+    return {"ok": True, "predictions": items}
+
+def serve():
+    """
+    Long-running mode: load the artifacts once, then answer each stdin line
+    {"id": ..., "data": <request>} with one stdout line {"id": ..., **result}.
+
+    Replies go to a private copy of stdout; fd 1 itself is pointed at stderr,
+    so library logging and stray prints can't interleave with them.
+    """
+    sys.stdout.flush()
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    load_artifacts()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        req_id = None
+        try:
+            request = loads(line)
+            req_id = request.get("id")
+            result = predict(request.get("data"))
+        except Exception as e:
+            result = {"error": str(e)}
+        emit({"id": req_id, **result}, replies)
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve()
+        return
+    data = read_input()
+    emit(predict(data))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,52 @@
+# backend/ml/rate_limiter.py
+"""
+Async token bucket for Gemini batch calls.
+
+Tracks two budgets refilled continuously by elapsed time: requests per minute
+and input tokens per minute. Limits default to the values below and can be
+overridden with GEMINI_RPM / GEMINI_TPM.
+"""
+import os
+import time
+import asyncio
+
+DEFAULT_RPM = 60
+DEFAULT_TPM = 250_000
+
+
+class TokenBucket:
+    def __init__(self, rpm: float = None, tpm: float = None):
+        self.rpm = float(rpm or os.environ.get("GEMINI_RPM") or DEFAULT_RPM)
+        self.tpm = float(tpm or os.environ.get("GEMINI_TPM") or DEFAULT_TPM)
+        self.request_tokens = self.rpm
+        self.token_tokens = self.tpm
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        self.request_tokens = min(self.rpm, self.request_tokens + elapsed * self.rpm / 60.0)
+        self.token_tokens = min(self.tpm, self.token_tokens + elapsed * self.tpm / 60.0)
+
+    async def acquire(self, tokens: int = 0):
+        """Wait until one request and `tokens` input tokens are available, then spend them."""
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.request_tokens >= 1 and self.token_tokens >= tokens:
+                    self.request_tokens -= 1
+                    self.token_tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self.request_tokens) * 60.0 / self.rpm,
+                    (tokens - self.token_tokens) * 60.0 / self.tpm,
+                )
+                await asyncio.sleep(wait)
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return len(text) // 4 + 1
@@ -0,0 +1,108 @@
+# backend/ml/response_cache.py
+"""
+Disk-backed cache for Gemini responses.
+
+Responses are stored in a small SQLite file under backend/ml/.cache/, keyed by
+SHA256(prompt || model || payload). The policy is picked with the
+CURASCAN_CACHE_MODE environment variable:
+
+  enabled  - return cached text on a hit; on a miss call the API and store it (default)
+  replay   - only serve from the cache; a miss raises instead of calling the API
+  disabled - always call the API and never read or write the cache
+
+Entries expire after CURASCAN_CACHE_TTL_DAYS (default 30) and the store keeps
+at most CURASCAN_CACHE_MAX_ENTRIES (default 10000), dropping the oldest first.
+Replay mode serves entries regardless of age.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+from contextlib import closing
+from typing import Callable, Optional
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), ".cache")
+CACHE_DB = os.path.join(CACHE_DIR, "gemini_responses.sqlite3")
+
+MODES = ("enabled", "replay", "disabled")
+
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 10_000
+
+
+def cache_mode() -> str:
+    mode = os.environ.get("CURASCAN_CACHE_MODE", "enabled").strip().lower()
+    if mode not in MODES:
+        raise RuntimeError(
+            f"Invalid CURASCAN_CACHE_MODE={mode!r}; expected one of {', '.join(MODES)}."
+        )
+    return mode
+
+
+def make_key(prompt: str, model: str, payload_bytes) -> str:
+    """SHA256(prompt || model || payload); payload may be any bytes-like object (e.g. an mmap)."""
+    h = hashlib.sha256(prompt.encode())
+    h.update(model.encode())
+    h.update(payload_bytes)
+    return h.hexdigest()
+
+
+def _ttl_seconds() -> float:
+    return float(os.environ.get("CURASCAN_CACHE_TTL_DAYS") or DEFAULT_TTL_DAYS) * 86400
+
+
+def _max_entries() -> int:
+    return int(os.environ.get("CURASCAN_CACHE_MAX_ENTRIES") or DEFAULT_MAX_ENTRIES)
+
+
+def _connect() -> sqlite3.Connection:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(CACHE_DB)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses "
+        "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL DEFAULT 0)"
+    )
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(responses)")]
+    if "created" not in columns:
+        # stores written before entries expired; their rows count as already stale
+        conn.execute("ALTER TABLE responses ADD COLUMN created REAL NOT NULL DEFAULT 0")
+    return conn
+
+
+def cached_call(key: str, fn: Callable[[], str], validate: Optional[Callable[[str], bool]] = None) -> str:
+    """
+    Return the cached response text for `key`, calling `fn()` on a miss.
+    Failed calls are not cached, and neither is text that `validate` rejects
+    (e.g. a refusal instead of JSON), so the next attempt calls the API again.
+    """
+    mode = cache_mode()
+    if mode == "disabled":
+        return fn()
+
+    with closing(_connect()) as conn:
+        row = conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+    if row is not None:
+        text, created = row
+        fresh = mode == "replay" or time.time() - created < _ttl_seconds()
+        if fresh and (validate is None or validate(text)):
+            return text
+
+    if mode == "replay":
+        raise RuntimeError(f"CURASCAN_CACHE_MODE=replay but no cached response for key {key[:12]}...")
+
+    text = fn()
+    with closing(_connect()) as conn, conn:
+        if validate is None or validate(text):
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                (key, text, time.time()),
+            )
+            conn.execute(
+                "DELETE FROM responses WHERE key NOT IN "
+                "(SELECT key FROM responses ORDER BY created DESC LIMIT ?)",
+                (_max_entries(),),
+            )
+        else:
+            # drop whatever stale or unusable entry was there
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+    return text
@@ -4,30 +4,90 @@ import numpy as np
 import os
 import joblib
 from sklearn.model_selection import train_test_split, StratifiedKFold, RandomizedSearchCV
-from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.ensemble import RandomForestClassifier, StackingClassifier
-from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import LabelEncoder
+from sklearn.ensemble import RandomForestClassifier, VotingClassifier
 from xgboost import XGBClassifier
 from sklearn.metrics import classification_report, confusion_matrix
-from imblearn.over_sampling import SMOTE
+from sklearn.utils.class_weight import compute_sample_weight
+
+# optional: ONNX export for onnxruntime inference in predict_model.py
+try:
+    from skl2onnx import convert_sklearn, update_registered_converter
+    from skl2onnx.common.data_types import FloatTensorType
+    from skl2onnx.common.shape_calculator import calculate_linear_classifier_output_shapes
+    from onnxmltools.convert.xgboost.operator_converters.XGBoost import convert_xgboost
+except ImportError:
+    convert_sklearn = None
 
 BASE_DIR = os.path.dirname(__file__)
-DATA_PATH = os.path.join(BASE_DIR, "synthetic_training.csv")
+DATA_PATH = os.path.join(BASE_DIR, "synthetic_training.parquet")
+CSV_DATA_PATH = os.path.join(BASE_DIR, "synthetic_training.csv")
 MODEL_OUT = os.path.join(BASE_DIR, "model.pkl")
 ENC_OUT = os.path.join(BASE_DIR, "label_encoder.pkl")
 SCALER_OUT = os.path.join(BASE_DIR, "scaler.pkl")
+ONNX_OUT = os.path.join(BASE_DIR, "model.onnx")
 
 def load_data():
-    df = pd.read_csv(DATA_PATH)
+    if os.path.exists(DATA_PATH):
+        print(f"Training data: {DATA_PATH}")
+        df = pd.read_parquet(DATA_PATH)
+    else:
+        print(f"Training data: {CSV_DATA_PATH} ({os.path.basename(DATA_PATH)} not found; "
+              "run generate_training_data.py to regenerate)")
+        df = pd.read_csv(CSV_DATA_PATH)
     df = df.dropna(subset=["value", "ref_lower", "ref_upper"])
     return df
 
 def make_features(df):
-    X = df[["value", "ref_lower", "ref_upper", "pct_of_range", "distance_lower", "distance_upper"]].values
+    X = df[["value", "ref_lower", "ref_upper", "pct_of_range", "distance_lower", "distance_upper"]].to_numpy(dtype=np.float32)
     return X
 
+def dump_atomic(obj, path):
+    """
+    joblib.dump to a temp file next to path, then os.replace it over path.
+    predict_model.py --serve memory-maps the pickles, so truncating and
+    rewriting them in place would pull the pages out from under it.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        joblib.dump(obj, tmp, compress=0)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def export_onnx(model, n_features):
+    """
+    Write model.onnx next to model.pkl. On any failure the stale file is
+    removed so predict_model.py falls back to the pickle.
+    """
+    if os.path.exists(ONNX_OUT):
+        os.remove(ONNX_OUT)
+    if convert_sklearn is None:
+        print("skl2onnx / onnxmltools not installed; skipping ONNX export.")
+        return
+    try:
+        update_registered_converter(
+            XGBClassifier, "XGBoostXGBClassifier",
+            calculate_linear_classifier_output_shapes, convert_xgboost,
+            options={"nocl": [True, False], "zipmap": [True, False, "columns"]},
+        )
+        onx = convert_sklearn(
+            model,
+            initial_types=[("input", FloatTensorType([None, n_features]))],
+            target_opset={"": 15, "ai.onnx.ml": 3},
+        )
+    except Exception as e:
+        print("ONNX export failed, predict_model.py will use model.pkl:", e)
+        return
+    tmp = f"{ONNX_OUT}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(onx.SerializeToString())
+    os.replace(tmp, ONNX_OUT)
+    print(" -", ONNX_OUT)
+
 def main():
-    if not os.path.exists(DATA_PATH):
+    if not (os.path.exists(DATA_PATH) or os.path.exists(CSV_DATA_PATH)):
         raise FileNotFoundError(DATA_PATH + " not found. Run generate_training_data.py first.")
     df = load_data()
     X = make_features(df)
@@ -35,16 +95,23 @@ def main():
     y = le.fit_transform(df["label"].astype(str))
 
     X_train, X_test, y_train, y_test = train_test_split(X, y, stratify=y, test_size=0.2, random_state=42)
+    # held-out slice for XGBoost early stopping
+    X_train, X_val, y_train, y_val = train_test_split(X_train, y_train, stratify=y_train, test_size=0.1, random_state=42)
 
-    sm = SMOTE(random_state=42)
-    X_train_res, y_train_res = sm.fit_resample(X_train, y_train)
+    # reweight classes instead of oversampling: same balancing, no synthetic rows.
+    # Passed as sample_weight to every learner (not RF class_weight too, or the
+    # ensemble's refit would weight RF twice).
+    sample_weight = compute_sample_weight("balanced", y_train)
 
-    scaler = StandardScaler()
-    X_train_res = scaler.fit_transform(X_train_res)
-    X_test_scaled = scaler.transform(X_test)
+    # no feature scaling: RF / XGB splits are scale-invariant
 
-    rf = RandomForestClassifier(random_state=42, n_jobs=-1)
-    xgb = XGBClassifier(use_label_encoder=False, eval_metric="mlogloss", random_state=42, n_jobs=-1)
+    # single-threaded during the search: RandomizedSearchCV already runs one
+    # fit per core, and per-estimator threads on top would oversubscribe them
+    rf = RandomForestClassifier(random_state=42, n_jobs=1)
+    xgb = XGBClassifier(
+        tree_method="hist", device="cpu", eval_metric="mlogloss",
+        early_stopping_rounds=20, random_state=42, n_jobs=1,
+    )
 
     rf_param = {
         "n_estimators": [100, 200],
@@ -62,35 +129,49 @@ def main():
 
     print("Running RandomizedSearchCV for XGBoost...")
     xgb_search = RandomizedSearchCV(xgb, xgb_param, n_iter=8, cv=skf, scoring="f1_macro", n_jobs=-1, random_state=42, verbose=1)
-    xgb_search.fit(X_train_res, y_train_res)
+    xgb_search.fit(X_train, y_train, sample_weight=sample_weight, eval_set=[(X_val, y_val)], verbose=False)
     best_xgb = xgb_search.best_estimator_
+    # the ensemble refits clones without an eval_set, so pin the tree count early stopping chose
+    best_xgb.set_params(n_estimators=best_xgb.best_iteration + 1, early_stopping_rounds=None)
     print("XGB best params:", xgb_search.best_params_)
 
     print("Running RandomizedSearchCV for RandomForest...")
     rf_search = RandomizedSearchCV(rf, rf_param, n_iter=6, cv=skf, scoring="f1_macro", n_jobs=-1, random_state=42, verbose=1)
-    rf_search.fit(X_train_res, y_train_res)
+    rf_search.fit(X_train, y_train, sample_weight=sample_weight)
     best_rf = rf_search.best_estimator_
     print("RF best params:", rf_search.best_params_)
 
+    # the final fits run one at a time, so each may use every core
+    best_rf.set_params(n_jobs=-1)
+    best_xgb.set_params(n_jobs=-1)
     estimators = [("rf", best_rf), ("xgb", best_xgb)]
-    stack = StackingClassifier(estimators=estimators, final_estimator=LogisticRegression(max_iter=1000), n_jobs=-1)
+    # soft vote: one fit per base learner, no cross_val_predict pass for a meta-model
+    ensemble = VotingClassifier(estimators=estimators, voting="soft", flatten_transform=False)
 
-    print("Training stacking classifier...")
-    stack.fit(X_train_res, y_train_res)
+    print("Training soft-voting ensemble...")
+    ensemble.fit(X_train, y_train, sample_weight=sample_weight)
 
-    preds = stack.predict(X_test_scaled)
+    preds = ensemble.predict(X_test)
     print("=== Classification Report ===")
     print(classification_report(y_test, preds, target_names=le.classes_))
     print("Confusion Matrix:")
     print(confusion_matrix(y_test, preds))
 
-    joblib.dump(stack, MODEL_OUT)
-    joblib.dump(le, ENC_OUT)
-    joblib.dump(scaler, SCALER_OUT)
+    # predict_model.py scores a handful of rows per report; joblib / OpenMP
+    # worker dispatch costs more than it saves at that size
+    for est in ensemble.estimators_:
+        est.set_params(n_jobs=1)
+
+    # uncompressed so predict_model.py can memory-map the arrays
+    dump_atomic(ensemble, MODEL_OUT)
+    dump_atomic(le, ENC_OUT)
+    if os.path.exists(SCALER_OUT):
+        # left over from a scaled model; predict_model.py would apply it
+        os.remove(SCALER_OUT)
     print("Saved model artifacts:")
     print(" -", MODEL_OUT)
     print(" -", ENC_OUT)
-    print(" -", SCALER_OUT)
+    export_onnx(ensemble, X.shape[1])
 
 if __name__ == "__main__":
     main()
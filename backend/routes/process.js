@@ -7,6 +7,7 @@ import { fileURLToPath } from "url";
 import { Report } from "../models/Report.js";
 import { runExtractor } from "../utils/runExtractor.js";
 import { runRecommendations } from "../utils/runRecommendations.js";
+import { runPredictor } from "../utils/runPredictor.js";
 import { getPythonPath } from "../utils/pythonPath.js";
 
 const router = express.Router();
@@ -90,20 +91,16 @@ router.post("/:reportId", async (req, res) => {
     const items = parsed.items || [];
 
     // Step 3️⃣ Predict
-    const predict = spawnSync(PYTHON_PATH, [predictScript], {
-      input: JSON.stringify({ items }),
-      encoding: "utf-8",
-      maxBuffer: 10 * 1024 * 1024,
-    });
-
-    if (predict.error || predict.status !== 0) {
-      console.error("Predict stderr:", predict.stderr);
+    let predResult;
+    try {
+      predResult = await runPredictor(PYTHON_PATH, predictScript, { items });
+    } catch (err) {
+      console.error("Predict stderr:", err.message);
       return res
         .status(500)
-        .json({ ok: false, msg: "Prediction failed", error: predict.stderr });
+        .json({ ok: false, msg: "Prediction failed", error: err.message });
     }
 
-    const predResult = JSON.parse(predict.stdout || "{}");
     const predictions = predResult.predictions || [];
     const finalPreds = applyHemoglobinRule(predictions, items);
 
@@ -0,0 +1,85 @@
+import { spawn } from "child_process";
+import path from "path";
+
+// one long-lived `predict_model.py --serve` process, so the model artifacts
+// are loaded once instead of on every request
+let child = null;
+let nextId = 1;
+// request id -> { resolve, reject }; replies echo the id, so they can't be
+// handed to the wrong request even if they arrive out of step
+const pending = new Map();
+
+function failPending(err) {
+  for (const { reject } of pending.values()) reject(err);
+  pending.clear();
+}
+
+function handleReply(line) {
+  let reply;
+  try {
+    reply = JSON.parse(line);
+  } catch {
+    console.error("Ignoring non-JSON predictor output:", line);
+    return;
+  }
+  const waiter = pending.get(reply?.id);
+  if (!waiter) {
+    console.error("Ignoring predictor reply for unknown request:", line);
+    return;
+  }
+  pending.delete(reply.id);
+  if (reply.error || !reply.ok) {
+    waiter.reject(new Error(reply.error || "predictor returned no result"));
+  } else {
+    waiter.resolve(reply);
+  }
+}
+
+function startPredictor(pythonPath, scriptPath) {
+  const proc = spawn(pythonPath, [path.resolve(scriptPath), "--serve"], {
+    stdio: ["pipe", "pipe", "pipe"],
+    windowsHide: true,
+  });
+
+  let stderr = "";
+  let buffer = "";
+
+  proc.stdout.setEncoding("utf8");
+  proc.stdout.on("data", (d) => {
+    buffer += d;
+    let nl;
+    while ((nl = buffer.indexOf("\n")) !== -1) {
+      const line = buffer.slice(0, nl);
+      buffer = buffer.slice(nl + 1);
+      if (line.trim()) handleReply(line);
+    }
+  });
+
+  // keep only the tail so warnings printed at load time don't pile up
+  proc.stderr.on("data", (d) => {
+    stderr = (stderr + d.toString()).slice(-4000);
+  });
+
+  proc.stdin.on("error", (err) => failPending(err));
+
+  proc.on("error", (err) => {
+    if (child === proc) child = null;
+    failPending(err);
+  });
+
+  proc.on("close", (code) => {
+    if (child === proc) child = null;
+    failPending(new Error(stderr || `predictor exited with code ${code}`));
+  });
+
+  return proc;
+}
+
+export function runPredictor(pythonPath, scriptPath, payload) {
+  return new Promise((resolve, reject) => {
+    if (!child) child = startPredictor(pythonPath, scriptPath);
+    const id = nextId++;
+    pending.set(id, { resolve, reject });
+    child.stdin.write(JSON.stringify({ id, data: payload }) + "\n");
+  });
+}
@@ -1,5 +1,5 @@
 ﻿#!/usr/bin/env python3
-"""
+r"""
 pd.py - Simple PDF extractor + optional Groq summarization.
 
 Usage:
@@ -12,11 +12,33 @@ Usage:
 import os
 import sys
 import argparse
+import functools
 import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from pypdf import PdfReader
+
+# PyMuPDF (MuPDF, in C) reads the text layer several times faster than pure-Python pypdf
+try:
+    import pymupdf
+except ImportError:
+    try:
+        import fitz as pymupdf  # PyMuPDF < 1.24.3
+    except ImportError:
+        pymupdf = None
+        from pypdf import PdfReader
+
+# Optional: exact token counts for the Groq prompt budget
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+SUMMARY_TOKEN_BUDGET = 2000  # roughly the old 8000-character cut
 
 # Optional imports (OCR + Groq). We'll import lazily to keep errors clear.
+# Cached: a process handling several PDFs resolves them once.
+@functools.lru_cache(maxsize=1)
 def try_imports():
     pdf2image_fn = None
     pytesseract_mod = None
@@ -46,32 +68,89 @@ def try_imports():
 
     return pdf2image_fn, pytesseract_mod, PIL_Image, GroqClass
 
-def extract_text_pypdf(path: str) -> str:
-    text = []
+def extract_text_native(path: str) -> list:
+    """Return [(page_index, text), ...] so callers can tell which pages lack a text layer."""
+    if pymupdf is not None:
+        with pymupdf.open(path) as doc:
+            return [(i, page.get_text("text")) for i, page in enumerate(doc)]
     reader = PdfReader(path)
-    for page in reader.pages:
-        page_text = page.extract_text()
-        if page_text:
-            text.append(page_text)
-    return "\n".join(text).strip()
-
-def ocr_pdf(path: str, convert_from_path_fn, pytesseract_mod, PIL_Image) -> str:
-    text = []
+    return [(i, page.extract_text() or "") for i, page in enumerate(reader.pages)]
+
+def join_pages(pages) -> str:
+    return "\n".join(text for _, text in pages if text).strip()
+
+def _init_ocr_worker():
+    # one tesseract per core already; stop each one from also spawning OpenMP threads
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def _ocr_page(image_path: str) -> str:
+    # runs in a worker process, so import here rather than pickling the module
+    import pytesseract
+    from PIL import Image
     try:
-        images = convert_from_path_fn(path, dpi=300)
-    except Exception as e:
-        print("[WARN] pdf2image.convert_from_path failed:", e)
+        with Image.open(image_path) as img:
+            return pytesseract.image_to_string(img)
+    except Exception:
         return ""
-    for img in images:
+
+def _page_runs(pages, size):
+    """Split sorted page indices into runs of consecutive pages, at most `size` long."""
+    runs = []
+    for p in pages:
+        if runs and p == runs[-1][-1] + 1 and len(runs[-1]) < size:
+            runs[-1].append(p)
+        else:
+            runs.append([p])
+    return runs
+
+def ocr_pdf(path: str, convert_from_path_fn, pages) -> list:
+    """
+    OCR the given 0-based pages, one tesseract process per core, and return
+    their text in the same order. Pages are rasterized to a temp dir a run at
+    a time, so OCR of one run overlaps rasterizing the next.
+    """
+    # no more processes than pages: with spawn (Windows/macOS) each one re-imports this module
+    workers = max(1, min(os.cpu_count() or 1, len(pages)))
+    futures = []  # one per page, None where the page produced no image
+    with tempfile.TemporaryDirectory() as tmp, ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker) as pool:
+        for run in _page_runs(pages, workers):
+            try:
+                # 200 DPI grayscale reads printed report text as well as 300 DPI RGB
+                # with far fewer pixels for tesseract to process
+                image_paths = convert_from_path_fn(
+                    path, dpi=200, grayscale=True, fmt="png", thread_count=workers,
+                    first_page=run[0] + 1, last_page=run[-1] + 1, output_folder=tmp, paths_only=True,
+                )
+            except Exception as e:
+                print("[WARN] pdf2image.convert_from_path failed:", e)
+                for f in futures:
+                    if f is not None:
+                        f.cancel()
+                return []
+            if len(image_paths) != len(run):
+                # can't tell which page is missing; skip the run rather than shift text onto the wrong pages
+                print(f"[WARN] pdf2image returned {len(image_paths)} image(s) for {len(run)} page(s); skipping OCR of pages {run[0] + 1}-{run[-1] + 1}.")
+                futures.extend([None] * len(run))
+                continue
+            futures.extend(pool.submit(_ocr_page, p) for p in image_paths)
+        return [f.result() if f is not None else "" for f in futures]
+
+def fit_summary_budget(text: str, budget: int = SUMMARY_TOKEN_BUDGET) -> str:
+    """
+    Drop repeated lines (per-page headers/footers) and blank lines, then keep
+    the leading text that fits in `budget` tokens.
+    """
+    lines = dict.fromkeys(line.strip() for line in text.splitlines())
+    text = "\n".join(line for line in lines if line)
+    if tiktoken is not None:
         try:
-            page_text = pytesseract_mod.image_to_string(img)
+            enc = tiktoken.get_encoding("cl100k_base")
         except Exception:
-            try:
-                page_text = pytesseract_mod.image_to_string(PIL_Image.fromarray(img))
-            except Exception:
-                page_text = ""
-        text.append(page_text)
-    return "\n".join(text).strip()
+            enc = None  # encoding file not cached and no network
+        if enc is not None:
+            tokens = enc.encode(text)
+            return text if len(tokens) <= budget else enc.decode(tokens[:budget])
+    return text[:budget * 4]  # ~4 characters per token
 
 def summarize_with_groq(text: str, GroqClass, api_key: str) -> str:
     if not text.strip():
@@ -80,7 +159,7 @@ def summarize_with_groq(text: str, GroqClass, api_key: str) -> str:
     prompt = (
         "You are a concise summarizer. Read the following extracted PDF text and "
         "produce a short bulleted summary of the key findings/values.\n\n"
-        f"{text[:8000]}"
+        f"{fit_summary_budget(text)}"
     )
     try:
         resp = client.chat.completions.create(
@@ -106,27 +185,35 @@ def main():
     # lazy imports
     convert_from_path_fn, pytesseract_mod, PIL_Image, GroqClass = try_imports()
 
-    # Step 1: Try pypdf extraction
-    print("[INFO] Trying native extraction with pypdf...")
-    extracted = extract_text_pypdf(pdf_path)
-    print(f"[INFO] Extracted {len(extracted)} characters via pypdf.")
+    # Step 1: Try native text-layer extraction
+    backend = "PyMuPDF" if pymupdf is not None else "pypdf"
+    print(f"[INFO] Trying native extraction with {backend}...")
+    pages = extract_text_native(pdf_path)
+    extracted = join_pages(pages)
+    print(f"[INFO] Extracted {len(extracted)} characters via {backend}.")
 
-    # Step 2: Fallback to OCR if very little text
-    if len(extracted.strip()) < 120:
+    # Step 2: OCR only the pages that have (almost) no text layer
+    empty_pages = [i for i, text in pages if len(text.strip()) < 40]
+    if empty_pages:
         if convert_from_path_fn and pytesseract_mod:
-            print("[INFO] Very little text found — falling back to OCR using pdf2image + pytesseract...")
-            ocr_text = ocr_pdf(pdf_path, convert_from_path_fn, pytesseract_mod, PIL_Image)
-            if ocr_text:
-                extracted = ocr_text
-                print(f"[INFO] Extracted {len(extracted)} characters via OCR.")
+            print(f"[INFO] {len(empty_pages)} of {len(pages)} page(s) have no text layer — running OCR on them using pdf2image + pytesseract...")
+            ocr_texts = ocr_pdf(pdf_path, convert_from_path_fn, empty_pages)
+            if any(text.strip() for text in ocr_texts):
+                by_page = dict(pages)
+                for i, text in zip(empty_pages, ocr_texts):
+                    if text.strip():
+                        by_page[i] = text
+                extracted = join_pages(by_page.items())
+                print(f"[INFO] Extracted {len(extracted)} characters after OCR.")
             else:
                 print("[WARN] OCR attempted but returned no text.")
         else:
             print("[WARN] pdf2image or pytesseract not available; skipping OCR fallback.")
     else:
-        print("[INFO] Native extraction seems sufficient; skipping OCR.")
+        print("[INFO] Every page has a text layer; skipping OCR.")
 
-    # Normalize whitespace a bit
+    # Normalize whitespace a bit (the summary still gets the line structure, for dedupe)
+    page_text = extracted
     extracted = " ".join(extracted.split())
 
     # Print result
@@ -144,7 +231,7 @@ def main():
             print("[WARN] groq SDK not installed in this environment. Install it with `pip install groq`.")
         else:
             print("[INFO] Summarizing using Groq...")
-            summary = summarize_with_groq(extracted, GroqClass, GROQ_API_KEY)
+            summary = summarize_with_groq(page_text, GroqClass, GROQ_API_KEY)
             print("\n======= Groq Summary =======\n")
             print(summary)
             print("\n======= End Summary =======\n")